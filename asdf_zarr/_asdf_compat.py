@@ -0,0 +1,125 @@
+"""
+Access to the private asdf block API.
+
+asdf does not (yet) provide a public API for writing blocks with
+options or for reading and writing individual blocks. All uses of
+private asdf modules are kept here so that changes in asdf (which
+may occur in any release) only need to be handled in one place.
+These functions are exercised by ``tests/test_asdf_compat.py``.
+"""
+
+import inspect
+import io
+import struct
+
+from asdf import _compression, constants, generic_io
+from asdf._block import io as _block_io
+from asdf._block.options import Options
+
+# asdf 5 added a required validate_checksum argument to read_block
+_READ_BLOCK_VALIDATE_CHECKSUM = "validate_checksum" in inspect.signature(_block_io.read_block).parameters
+
+
+def find_available_block_index(ctx, data_callback, key, compression, compression_kwargs=None):
+    """
+    Like `asdf.extension.SerializationContext.find_available_block_index`
+    but compressing the block with the provided asdf compression.
+
+    Note that asdf collects the compressions used in a file (to record any
+    compression extensions in the file history) before converting the tree.
+    Compressions that come from ``all_array_compression`` (or ``input``) are
+    included, other compressions will not be recorded.
+    """
+    if not compression:
+        return ctx.find_available_block_index(data_callback, key)
+    # a storage type of None follows the asdf all_array_storage setting
+    options = Options(None, compression, compression_kwargs)
+    return ctx._blocks.make_write_block(data_callback, options, key)
+
+
+def validate_compression(compression):
+    """
+    Validate an asdf block compression (``input`` is not a valid block compression).
+
+    Raises
+    ------
+    ValueError
+    """
+    if compression == "input":
+        raise ValueError("input is not a valid block compression")
+    return _compression.validate(compression)
+
+
+def open_file(path):
+    """
+    Open a new file (at path) for reading and writing asdf blocks.
+    """
+    return generic_io.get_file(open(path, "w+b"), mode="rw", close=True)
+
+
+def encode_block(data, compression=None, compression_kwargs=None, allocated_size=None):
+    """
+    Encode data (a 1D uint8 array) as an asdf block (including the block magic).
+
+    If allocated_size is provided the block will be padded to fill allocated_size
+    bytes. None is returned if the encoded data does not fit in allocated_size.
+    """
+    buff = io.BytesIO()
+    fd = generic_io.get_file(buff, mode="w")
+    fd.write(constants.BLOCK_MAGIC)
+    header = _block_io.write_block(fd, data, compression=compression, compression_kwargs=compression_kwargs)
+    block_bytes = buff.getvalue()
+    if allocated_size is None:
+        return block_bytes
+    if header["used_size"] > allocated_size:
+        return None
+    header_bytes = _block_io.BLOCK_HEADER.pack(**{**header, "allocated_size": allocated_size})
+    prefix = constants.BLOCK_MAGIC + struct.pack(">H", len(header_bytes)) + header_bytes
+    data_start = len(constants.BLOCK_MAGIC) + 2 + _block_io.BLOCK_HEADER.size
+    block_data = block_bytes[data_start : data_start + header["used_size"]]
+    return prefix + block_data + b"\0" * (allocated_size - header["used_size"])
+
+
+def block_allocated_size(block_bytes):
+    """
+    Size of the data allocated for a block returned by `encode_block`.
+    """
+    header_start = len(constants.BLOCK_MAGIC) + 2
+    header = _block_io.BLOCK_HEADER.unpack(block_bytes[header_start : header_start + _block_io.BLOCK_HEADER.size])
+    return header["allocated_size"]
+
+
+def read_block(fd, offset):
+    """
+    Read (and decompress) the data for the block at offset (the start
+    of the block magic). The file position is not changed.
+    """
+    position = fd.tell()
+    kwargs = {"offset": offset + len(constants.BLOCK_MAGIC)}
+    if _READ_BLOCK_VALIDATE_CHECKSUM:
+        kwargs["validate_checksum"] = False
+    _, _, _, data = _block_io.read_block(fd, **kwargs)
+    fd.seek(position)
+    return data
+
+
+def pop_block_index(fd):
+    """
+    Read and remove the block index at the end of the file returning
+    the block offsets. The file position is set to the end of the
+    last block.
+    """
+    index_offset = _block_io.find_block_index(fd, 0)
+    if index_offset is None:
+        raise ValueError("Failed to find block index")
+    offsets = _block_io.read_block_index(fd, index_offset)
+    fd.seek(index_offset)
+    fd.truncate(index_offset)
+    return offsets
+
+
+def write_block_index(fd, offsets):
+    """
+    Write a block index (at the current file position).
+    """
+    _block_io.write_block_index(fd, offsets)
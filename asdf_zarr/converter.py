@@ -1,25 +1,39 @@
-import asyncio
-import json
-
 import asdf
-import zarr
-import zarr.buffer
 
-from . import util
-from . import storage
+# zarr, numpy, fsspec and the asdf_zarr storage/util modules are only
+# imported inside the converter methods. asdf loads every installed
+# extension when it resolves tags so importing them here would make
+# every asdf-using process pay the zarr import cost.
 
 
 class ZarrConverter(asdf.extension.Converter):
     tags = ["asdf://asdf-format.org/zarr/tags/zarr-*"]
-    types = ["zarr.core.array.Array"]
+    types = ["zarr.core.array.Array", "asdf_zarr.storage._StreamingArray"]
 
     def to_yaml_tree(self, obj, tag, ctx):
+        import zarr
+
+        from . import _asdf_compat, storage, util
+
+        if isinstance(obj, storage._StreamingArray):
+            store = obj.store
+            if not store._writing_tree:
+                raise ValueError(f"{store} arrays can only be written by the store")
+            # the store writes chunk blocks after the tree so only include
+            # the metadata and an (empty) chunk_block_map that the store
+            # fills in when it is closed
+            obj.chunk_block_map_index = ctx.find_available_block_index(lambda: store._chunk_block_map)
+            return {
+                ".zarray": store._meta,
+                "chunk_compression": store._chunk_compression,
+                "chunk_block_map": obj.chunk_block_map_index,
+            }
+
         chunk_store = obj.store
         # these storage types require conversion to an internal store so make it the default
         if isinstance(chunk_store, (zarr.storage.MemoryStore, storage.ASDFBlockStore)):
             chunk_store = storage.WrappedStore(chunk_store)
         if isinstance(chunk_store, storage.WrappedStore):
-            # TODO should we enforce no zarr compression here?
             # include data from this zarr array in the asdf file
             meta = obj.metadata.to_dict()
             obj_dict = {}
@@ -27,12 +41,19 @@ class ZarrConverter(asdf.extension.Converter):
             # include the meta data in the tree
             obj_dict[".zarray"] = meta
 
+            # chunks encoded by a zarr compressor are stored in uncompressed
+            # blocks, record the asdf compression used for the chunk blocks
+            compression = storage._select_chunk_compression(obj)
+            obj_dict["chunk_compression"] = compression
+
             # update callbacks
             chunk_key_block_index_map = {}
             for chunk_key in storage._iter_chunk_keys(obj, only_initialized=True):
                 data_callback = storage._generate_chunk_data_callback(obj, chunk_key)
                 asdf_key = getattr(chunk_store, "_chunk_asdf_keys", {}).get(chunk_key, ctx.generate_block_key())
-                block_index = ctx.find_available_block_index(data_callback, asdf_key)
+                block_index = _asdf_compat.find_available_block_index(
+                    ctx, data_callback, asdf_key, compression, asdf.get_config().all_array_compression_kwargs
+                )
                 chunk_key_block_index_map[chunk_key] = block_index
             asdf_key = getattr(chunk_store, "_chunk_block_map_asdf_key", None)
             if asdf_key is None:
@@ -47,13 +68,19 @@ class ZarrConverter(asdf.extension.Converter):
         return obj_dict
 
     def from_yaml_tree(self, node, tag, ctx):
+        import zarr
+
+        from . import storage, util
+
         if ".zarray" in node and "chunk_block_map" in node:
             # this is an internally stored zarr array
             # setup an ASDFBlockStore to read block data (when requested)
             zarray_meta = node[".zarray"]
             chunk_block_map_index = node["chunk_block_map"]
 
-            store = storage.ASDFBlockStore(ctx, chunk_block_map_index, zarray_meta)
+            store = storage.ASDFBlockStore(
+                ctx, chunk_block_map_index, zarray_meta, chunk_compression=node.get("chunk_compression")
+            )
 
             # TODO read/write mode here
             obj = zarr.open_array(store=store, zarr_format=2)
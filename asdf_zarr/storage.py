@@ -7,10 +7,13 @@ import tempfile
 import asdf
 import numpy
 import zarr
+import zarr.buffer
 
 from zarr.core.common import concurrent_map
 from zarr.core.sync import sync
 
+from . import _asdf_compat
+
 
 MISSING_CHUNK = -1
 
@@ -69,6 +72,31 @@ def _generate_chunk_map_callback(zarray, chunk_key_block_index_map):
     return chunk_map_callback
 
 
+def _select_chunk_compression(zarray):
+    """
+    Select the asdf compression used for blocks containing chunks of zarray.
+
+    Chunks already encoded by a zarr compressor are written as uncompressed
+    asdf blocks so each chunk is only compressed (and decompressed) once.
+    Uncompressed chunks use the asdf ``all_array_compression`` setting
+    (with ``input`` keeping the compression used when the array was read).
+
+    Returns
+    -------
+    compression : str or None
+        asdf compression label or None for uncompressed blocks
+    """
+    if zarray.metadata.to_dict().get("compressor") is not None:
+        return None
+    cfg = asdf.get_config()
+    if cfg.all_array_compression == "input":
+        store = zarray.store
+        if isinstance(store, WrappedStore):
+            store = store._wrapped_store
+        return getattr(store, "_chunk_compression", None)
+    return cfg.all_array_compression
+
+
 def to_internal(zarray):
     if isinstance(zarray.store, WrappedStore):
         return zarray
@@ -141,11 +169,43 @@ class WrappedStore(zarr.abc.store.Store):
             yield key
 
 
-class ASDFBlockStore(zarr.abc.store.Store):
+class _BaseBlockStore(zarr.abc.store.Store):
+    """
+    Listing (and partial value) methods shared by the stores
+    backed by ASDF blocks. Subclasses implement get and list.
+    """
+
     supports_listing = True
     supports_partial_writes = False
 
-    def __init__(self, ctx, chunk_block_map_index, zarray_meta, tmp_path=None, read_only=False):
+    async def get_partial_values(self, prototype=None, key_ranges=None):
+        # All the key-ranges arguments goes with the same prototype
+        async def _get(key: str, byte_range):
+            return await self.get(key, prototype=prototype, byte_range=byte_range)
+
+        return await concurrent_map(key_ranges, _get, limit=None)
+
+    async def list_dir(self, prefix):
+        if prefix.endswith("/"):
+            dir_prefix = prefix
+        else:
+            dir_prefix = prefix + "/"
+        async for key in self.list():
+            if key.startswith(dir_prefix):
+                key = key.removeprefix(dir_prefix)
+                if "/" in key:
+                    yield key.split("/")[0]
+                else:
+                    yield key
+
+    async def list_prefix(self, prefix):
+        async for key in self.list():
+            if key.startswith(prefix):
+                yield key
+
+
+class ASDFBlockStore(_BaseBlockStore):
+    def __init__(self, ctx, chunk_block_map_index, zarray_meta, tmp_path=None, read_only=False, chunk_compression=None):
         super().__init__()
 
         if tmp_path is None:
@@ -158,6 +218,8 @@ class ASDFBlockStore(zarr.abc.store.Store):
 
         self._deleted_keys = set()
         self._read_only = read_only
+        # asdf compression of the chunk blocks (used for "input" compression)
+        self._chunk_compression = chunk_compression
 
         # the chunk_block_map contains block indices
         # organized in an array shaped like the chunks
@@ -259,13 +321,6 @@ class ASDFBlockStore(zarr.abc.store.Store):
         # then blocks
         return key in self._chunk_callbacks
 
-    async def get_partial_values(self, prototype=None, key_ranges=None):
-        # All the key-ranges arguments goes with the same prototype
-        async def _get(key: str, byte_range):
-            return await self.get(key, prototype=prototype, byte_range=byte_range)
-
-        return await concurrent_map(key_ranges, _get, limit=None)
-
     async def list(self):
         reported = set()
         async for key in self._tmp_store.list():
@@ -279,20 +334,239 @@ class ASDFBlockStore(zarr.abc.store.Store):
                 reported.add(key)
                 yield key
 
-    async def list_dir(self, prefix):
-        if prefix.endswith("/"):
-            dir_prefix = prefix
-        else:
-            dir_prefix = prefix + "/"
-        async for key in self.list():
-            if key.startswith(dir_prefix):
-                key = key.removeprefix(dir_prefix)
-                if "/" in key:
-                    yield key.split("/")[0]
-                else:
-                    yield key
 
-    async def list_prefix(self, prefix):
-        async for key in self.list():
-            if key.startswith(prefix):
-                yield key
+class _StreamingArray:
+    """
+    Placeholder for the zarr array of an `ASDFStreamingStore` used
+    (only) while the store writes the tree.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        # set by the converter
+        self.chunk_block_map_index = None
+
+
+class ASDFStreamingStore(_BaseBlockStore):
+    """
+    Write-only store that streams a zarr array into a new ASDF file.
+
+    Each chunk is written to an ASDF block as it is set so the array
+    never needs to be held in memory (or a temporary store). The tree is
+    written before the first chunk (once the array metadata is known) with
+    a placeholder ``chunk_block_map`` block that is filled in on ``close``.
+
+    A chunk that is set more than once is overwritten in place if the
+    encoded chunk fits in the existing block (as is always the case for
+    chunks without compression). Otherwise a new block is written.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path of the ASDF file to write.
+
+    tree : dict, optional
+        Tree to write to the ASDF file.
+
+    array_key : str, optional
+        Key in the tree used for the zarr array.
+
+    compression : str, optional
+        asdf compression to use for chunk blocks. This is ignored if
+        the zarr array compresses chunks.
+
+    compression_kwargs : dict, optional
+        Keyword arguments for the chunk block compression. Defaults
+        to the asdf ``all_array_compression_kwargs`` setting.
+
+    Notes
+    -----
+    zarr sets chunks from another thread so the asdf config (which can be
+    thread-local, see `asdf.config_context`) is read when the store is
+    created and used for writing the tree and chunk blocks.
+    """
+
+    def __init__(self, path, tree=None, array_key="data", compression=None, compression_kwargs=None):
+        super().__init__()
+        self._path = str(path)
+        self._tree = {} if tree is None else tree
+        self._array_key = array_key
+        self._compression = _asdf_compat.validate_compression(compression)
+
+        cfg = asdf.get_config()
+        if cfg.all_array_storage == "external":
+            raise ValueError("ASDFStreamingStore does not support external array storage")
+        self._array_storage = cfg.all_array_storage
+        self._array_compression = cfg.all_array_compression
+        self._array_compression_kwargs = cfg.all_array_compression_kwargs
+        if compression_kwargs is None:
+            compression_kwargs = cfg.all_array_compression_kwargs
+        self._compression_kwargs = compression_kwargs
+
+        self._zarray_meta = None
+        self._zattrs = None
+        self._fd = None
+        self._closed = False
+        self._writing_tree = False
+
+        # set when the tree is written
+        self._meta = None
+        self._chunk_compression = None
+        self._chunk_block_map = None
+        self._chunk_block_map_index = None
+
+        # offsets of all blocks (including blocks written with the tree)
+        self._block_offsets = []
+        self._end_offset = None
+        # block index and allocated size for each written chunk
+        self._chunk_block_indices = {}
+        self._block_allocated_sizes = {}
+        # blocks of deleted chunks (reused if the chunk is set again)
+        self._deleted_block_indices = {}
+
+    @property
+    def supports_writes(self):
+        return not self._closed
+
+    @property
+    def supports_deletes(self):
+        return not self._closed
+
+    def __eq__(self, other):
+        return isinstance(other, ASDFStreamingStore) and self._path == other._path
+
+    def __repr__(self):
+        return f"ASDFStreamingStore('{self._path}')"
+
+    def _write_tree(self):
+        if self._zarray_meta is None:
+            raise ValueError("zarr array metadata must be set before chunks are written")
+        self._meta = self._zarray_meta.copy()
+        self._meta["attributes"] = self._zattrs or {}
+        if self._meta.get("compressor") is None:
+            self._chunk_compression = self._compression
+
+        cdata_shape = tuple(math.ceil(s / c) for s, c in zip(self._meta["shape"], self._meta["chunks"]))
+        self._chunk_block_map = numpy.full(cdata_shape, MISSING_CHUNK, dtype="int32")
+
+        # the converter writes the metadata and the (empty) chunk_block_map
+        # block for this store, the chunk blocks are appended after
+        # the blocks written with the tree (replacing the block index)
+        placeholder = _StreamingArray(self)
+        tree = self._tree.copy()
+        tree[self._array_key] = placeholder
+        self._fd = _asdf_compat.open_file(self._path)
+        self._writing_tree = True
+        try:
+            asdf.AsdfFile(tree).write_to(
+                self._fd,
+                all_array_storage=self._array_storage,
+                all_array_compression=self._array_compression,
+                compression_kwargs=self._array_compression_kwargs,
+            )
+        finally:
+            self._writing_tree = False
+        self._chunk_block_map_index = placeholder.chunk_block_map_index
+        self._block_offsets = _asdf_compat.pop_block_index(self._fd)
+        self._end_offset = self._fd.tell()
+
+    def _write_chunk(self, key, data):
+        compression_kwargs = self._compression_kwargs
+        block_index = self._chunk_block_indices.get(key, self._deleted_block_indices.pop(key, None))
+        if block_index is not None:
+            block = _asdf_compat.encode_block(
+                data, self._chunk_compression, compression_kwargs, self._block_allocated_sizes[block_index]
+            )
+            if block is not None:
+                # overwrite the existing block
+                self._fd.seek(self._block_offsets[block_index])
+                self._fd.write(block)
+                self._chunk_block_indices[key] = block_index
+                return
+        block = _asdf_compat.encode_block(data, self._chunk_compression, compression_kwargs)
+        block_index = len(self._block_offsets)
+        self._fd.seek(self._end_offset)
+        self._fd.write(block)
+        self._block_offsets.append(self._end_offset)
+        self._end_offset += len(block)
+        self._block_allocated_sizes[block_index] = _asdf_compat.block_allocated_size(block)
+        self._chunk_block_indices[key] = block_index
+
+    async def set(self, key, value):
+        if not self.supports_writes:
+            raise ValueError("store is closed and does not support writing")
+        if key in (".zarray", ".zattrs"):
+            if self._fd is not None:
+                raise ValueError("zarr array metadata can not be changed after chunks are written")
+            if key == ".zarray":
+                self._zarray_meta = json.loads(value.to_bytes())
+            else:
+                self._zattrs = json.loads(value.to_bytes())
+            return
+        if self._fd is None:
+            self._write_tree()
+        self._write_chunk(key, numpy.frombuffer(value.to_bytes(), dtype="uint8"))
+
+    async def get(self, key, prototype=None, byte_range=None):
+        if key == ".zarray" and self._zarray_meta is not None:
+            return zarr.buffer.cpu.Buffer.from_bytes(json.dumps(self._zarray_meta).encode("ascii"))
+        if key == ".zattrs" and self._zattrs is not None:
+            return zarr.buffer.cpu.Buffer.from_bytes(json.dumps(self._zattrs).encode("ascii"))
+        if key not in self._chunk_block_indices:
+            return None
+        if self._closed:
+            raise ValueError("store is closed and does not support reading chunks")
+        # read back the chunk (for example, for a partial chunk update)
+        data = _asdf_compat.read_block(self._fd, self._block_offsets[self._chunk_block_indices[key]])
+        return zarr.buffer.cpu.Buffer.from_bytes(data.tobytes())
+
+    async def delete(self, key):
+        if not self.supports_deletes:
+            raise ValueError("store is closed and does not support writing")
+        if key in (".zarray", ".zattrs"):
+            if self._fd is not None:
+                raise ValueError("zarr array metadata can not be changed after chunks are written")
+            if key == ".zarray":
+                self._zarray_meta = None
+            else:
+                self._zattrs = None
+        elif key in self._chunk_block_indices:
+            self._deleted_block_indices[key] = self._chunk_block_indices.pop(key)
+
+    async def exists(self, key):
+        if key == ".zarray":
+            return self._zarray_meta is not None
+        if key == ".zattrs":
+            return self._zattrs is not None
+        return key in self._chunk_block_indices
+
+    async def list(self):
+        if self._zarray_meta is not None:
+            yield ".zarray"
+        if self._zattrs is not None:
+            yield ".zattrs"
+        for key in list(self._chunk_block_indices):
+            yield key
+
+    def close(self):
+        """
+        Finish writing the ASDF file by filling in the ``chunk_block_map``
+        and writing a block index.
+        """
+        if self._closed:
+            return
+        if self._fd is None:
+            self._write_tree()
+        _sep = self._meta.get("dimension_separator", ".")
+        for chunk_key, block_index in self._chunk_block_indices.items():
+            coords = tuple(int(k) for k in chunk_key.split(_sep))
+            self._chunk_block_map[coords] = block_index
+
+        # overwrite the placeholder chunk_block_map (which has the same size)
+        self._fd.seek(self._block_offsets[self._chunk_block_map_index])
+        self._fd.write(_asdf_compat.encode_block(self._chunk_block_map.ravel().view("uint8")))
+        self._fd.seek(self._end_offset)
+        _asdf_compat.write_block_index(self._fd, self._block_offsets)
+        self._fd.close()
+        self._closed = True
+        super().close()
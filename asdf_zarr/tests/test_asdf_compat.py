@@ -0,0 +1,126 @@
+import zlib
+
+import asdf
+import numpy
+import pytest
+import zarr
+
+from asdf_zarr import _asdf_compat
+
+
+class _Compressor(asdf.extension.Compressor):
+    label = b"tst1"
+
+    def compress(self, data, **kwargs):
+        yield zlib.compress(data.tobytes())
+
+    def decompress(self, data, out, **kwargs):
+        decompressed = zlib.decompress(b"".join(data))
+        out[: len(decompressed)] = numpy.frombuffer(decompressed, dtype="uint8")
+        return len(decompressed)
+
+
+class _CompressorExtension(asdf.extension.Extension):
+    extension_uri = "asdf://asdf-format.org/zarr/tests/extensions/compressor-1.0.0"
+    compressors = [_Compressor()]
+
+
+def _uncompressed_zarray():
+    arr = zarr.create(
+        (6, 9), store=zarr.storage.MemoryStore(), chunks=(2, 3), dtype="f8", zarr_format=2, compressor=None
+    )
+    arr[:] = numpy.arange(54).reshape((6, 9))
+    return arr
+
+
+def _chunk_block_compressions(af):
+    chunk_map = af._blocks.blocks[-1].data.view("int32")
+    return {
+        asdf._compression.validate(af._blocks.blocks[int(index)].header["compression"])
+        for index in chunk_map[chunk_map != -1]
+    }
+
+
+@pytest.mark.parametrize("array_storage", ["internal", "inline"])
+def test_find_available_block_index(tmp_path, array_storage):
+    # compressed chunk blocks should follow the asdf array storage settings
+    arr = _uncompressed_zarray()
+    fn = tmp_path / "test.asdf"
+    asdf.AsdfFile({"arr": arr}).write_to(fn, all_array_compression="zlib", all_array_storage=array_storage)
+    with asdf.open(fn) as af:
+        assert _chunk_block_compressions(af) == {"zlib"}
+        assert numpy.array_equal(af["arr"][:], arr[:])
+
+
+def test_find_available_block_index_no_compression():
+    class FakeContext:
+        def find_available_block_index(self, data_callback, key):
+            return (data_callback, key)
+
+    # uncompressed blocks only use the public SerializationContext API
+    assert _asdf_compat.find_available_block_index(FakeContext(), 1, 2, None) == (1, 2)
+
+
+@pytest.fixture
+def compressor_extension():
+    # zarr reads chunks in another thread so add the extension to
+    # the global config (asdf.config_context is thread-local)
+    extension = _CompressorExtension()
+    asdf.get_config().add_extension(extension)
+    yield extension
+    asdf.get_config().remove_extension(extension)
+
+
+def test_extension_compression(tmp_path, compressor_extension):
+    arr = _uncompressed_zarray()
+    fn = tmp_path / "test.asdf"
+    asdf.AsdfFile({"arr": arr}).write_to(fn, all_array_compression="tst1")
+    with asdf.open(fn) as af:
+        assert _chunk_block_compressions(af) == {"tst1"}
+        assert numpy.array_equal(af["arr"][:], arr[:])
+        # the compression extension should be recorded in the history
+        uris = [e.extension_uri for e in af["history"]["extensions"]]
+        assert compressor_extension.extension_uri in uris
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_block_io(tmp_path, compression):
+    fn = tmp_path / "test.asdf"
+    tree_data = numpy.arange(10)
+    data = numpy.arange(100, dtype="uint8")
+
+    fd = _asdf_compat.open_file(fn)
+    asdf.AsdfFile({"a": tree_data}).write_to(fd)
+    offsets = _asdf_compat.pop_block_index(fd)
+    assert len(offsets) == 1
+
+    block = _asdf_compat.encode_block(data, compression)
+    offsets.append(fd.tell())
+    fd.write(block)
+    assert numpy.array_equal(_asdf_compat.read_block(fd, offsets[-1]), data)
+
+    # re-encode the block in place padded to the original allocated size
+    allocated_size = _asdf_compat.block_allocated_size(block)
+    assert _asdf_compat.encode_block(numpy.zeros(1000, dtype="uint8"), None, allocated_size=allocated_size) is None
+    new_data = data[::-1].copy()
+    new_block = _asdf_compat.encode_block(new_data, compression, allocated_size=allocated_size)
+    assert len(new_block) == len(block)
+    end = fd.tell()
+    fd.seek(offsets[-1])
+    fd.write(new_block)
+    fd.seek(end)
+    _asdf_compat.write_block_index(fd, offsets)
+    fd.close()
+
+    with asdf.open(fn) as af:
+        assert numpy.array_equal(af["a"], tree_data)
+        assert len(af._blocks.blocks) == 2
+        assert numpy.array_equal(af._blocks.blocks[1].data, new_data)
+
+
+def test_validate_compression():
+    assert _asdf_compat.validate_compression(None) is None
+    assert _asdf_compat.validate_compression("zlib") == "zlib"
+    for compression in ("input", "foo"):
+        with pytest.raises(ValueError):
+            _asdf_compat.validate_compression(compression)
@@ -0,0 +1,186 @@
+import asdf
+import numpy as np
+import pytest
+import zarr
+
+from asdf_zarr.storage import ASDFBlockStore, ASDFStreamingStore, _StreamingArray
+
+
+@pytest.mark.parametrize("compressor", [None, {"id": "zlib", "level": 1}])
+@pytest.mark.parametrize("dimension_separator", [".", "/"])
+def test_streaming_store(tmp_path, compressor, dimension_separator):
+    fn = tmp_path / "test.asdf"
+    store = ASDFStreamingStore(fn, tree={"meta": {"a": 1}}, array_key="arr", compression="zlib")
+    arr = zarr.create(
+        (6, 9),
+        store=store,
+        chunks=(2, 3),
+        dtype="f8",
+        zarr_format=2,
+        compressor=compressor,
+        dimension_separator=dimension_separator,
+    )
+    # write whole chunks, then partially update one chunk (which requires reading it back)
+    arr[:4] = np.arange(36).reshape((4, 9))
+    arr[3:5, 0] = -1
+    expected = arr[:]
+    store.close()
+
+    with pytest.raises(ValueError, match="closed"):
+        arr[5, 5] = 1
+
+    with asdf.open(fn) as af:
+        assert af["meta"] == {"a": 1}
+        assert isinstance(af["arr"].store, ASDFBlockStore)
+        assert np.array_equal(af["arr"][:], expected)
+        # the last row of chunks was never written
+        assert not np.any(af["arr"][4:, 1:])
+        # the extension should be recorded like for any other zarr array
+        uris = [e.extension_uri for e in af["history"]["extensions"]]
+        assert "asdf://asdf-format.org/zarr/tags/zarr-1.0.0" in uris
+    with asdf.open(fn, _force_raw_types=True) as af:
+        assert af["arr"]["chunk_compression"] == (None if compressor else "zlib")
+
+
+def test_tree_arrays(tmp_path):
+    fn = tmp_path / "test.asdf"
+    aux = np.arange(100)
+    store = ASDFStreamingStore(fn, tree={"aux": aux, "more_aux": aux * 2})
+    arr = zarr.create((6, 9), store=store, chunks=(2, 3), dtype="f8", zarr_format=2)
+    arr[:] = 1
+    store.close()
+
+    # arrays in the tree should be stored in blocks (not inline)
+    with asdf.open(fn, _force_raw_types=True) as af:
+        assert "source" in af["aux"]
+        assert "source" in af["more_aux"]
+    with asdf.open(fn) as af:
+        assert np.array_equal(af["aux"], aux)
+        assert np.array_equal(af["more_aux"], aux * 2)
+        assert np.all(af["data"][:] == 1)
+
+
+@pytest.mark.parametrize("compressor", [None, {"id": "zlib", "level": 1}])
+def test_overwrite_in_place(tmp_path, compressor):
+    fn = tmp_path / "test.asdf"
+    store = ASDFStreamingStore(fn)
+    arr = zarr.create((100,), store=store, chunks=(100,), dtype="f8", zarr_format=2, compressor=compressor)
+    for i in range(1, 101):
+        arr[i - 1] = i
+    store.close()
+
+    with asdf.open(fn) as af:
+        assert np.array_equal(af["data"][:], np.arange(1, 101))
+        n_blocks = len(af._blocks.blocks)
+    if compressor is None:
+        # the uncompressed chunk always fits in the first block
+        # (the other block is the chunk_block_map)
+        assert n_blocks == 2
+    else:
+        # compressed chunks are only rewritten when they no longer fit
+        assert n_blocks < 100
+
+
+def test_no_chunks(tmp_path):
+    fn = tmp_path / "test.asdf"
+    with ASDFStreamingStore(fn) as store:
+        zarr.create((6, 9), store=store, chunks=(2, 3), dtype="f8", zarr_format=2, fill_value=42)
+    with asdf.open(fn) as af:
+        assert np.all(af["data"][:] == 42)
+
+
+def test_metadata_after_chunks(tmp_path):
+    store = ASDFStreamingStore(tmp_path / "test.asdf")
+    arr = zarr.create((6, 9), store=store, chunks=(2, 3), dtype="f8", zarr_format=2)
+    arr[:2, :3] = 1
+    with pytest.raises(ValueError, match="can not be changed"):
+        arr.attrs["a"] = 1
+    for key in (".zarray", ".zattrs"):
+        with pytest.raises(ValueError, match="can not be changed"):
+            zarr.core.sync.sync(store.delete(key))
+    store.close()
+    with asdf.open(tmp_path / "test.asdf") as af:
+        assert np.all(af["data"][:2, :3] == 1)
+
+
+def test_metadata_before_chunks(tmp_path):
+    store = ASDFStreamingStore(tmp_path / "test.asdf")
+    zarr.create((6, 9), store=store, chunks=(2, 3), dtype="f8", zarr_format=2)
+    # metadata can be deleted (and replaced) before any chunks are written
+    zarr.core.sync.sync(store.delete(".zattrs"))
+    assert not zarr.core.sync.sync(store.exists(".zattrs"))
+    arr = zarr.create((6, 9), store=store, chunks=(2, 3), dtype="i4", zarr_format=2, overwrite=True)
+    arr[:] = 3
+    store.close()
+    with asdf.open(tmp_path / "test.asdf") as af:
+        assert af["data"].dtype == np.dtype("i4")
+        assert np.all(af["data"][:] == 3)
+
+
+@pytest.mark.parametrize("compression", ["input", "foo"])
+def test_invalid_compression(tmp_path, compression):
+    with pytest.raises(ValueError):
+        ASDFStreamingStore(tmp_path / "test.asdf", compression=compression)
+
+
+def test_external_array_storage(tmp_path):
+    with asdf.config_context() as cfg:
+        cfg.all_array_storage = "external"
+        with pytest.raises(ValueError, match="external"):
+            ASDFStreamingStore(tmp_path / "test.asdf")
+
+
+def test_config_context(tmp_path):
+    # chunks are set from the zarr event loop thread so check that the
+    # (thread-local) config active when the store was created is used
+    fn = tmp_path / "test.asdf"
+    aux = np.arange(10)
+    with asdf.config_context() as cfg:
+        cfg.all_array_storage = "inline"
+        cfg.all_array_compression_kwargs = {"level": 0}
+        store = ASDFStreamingStore(fn, tree={"aux": aux}, compression="zlib")
+        arr = zarr.create((6, 9), store=store, chunks=(2, 3), dtype="f8", zarr_format=2, compressor=None)
+        arr[:] = 1
+        store.close()
+
+    with asdf.open(fn, _force_raw_types=True) as af:
+        assert "data" in af["aux"]
+        chunk_block_map_index = af["data"]["chunk_block_map"]
+    with asdf.open(fn) as af:
+        assert np.array_equal(af["aux"], aux)
+        assert np.all(af["data"][:] == 1)
+        chunk_map = af._blocks.blocks[chunk_block_map_index].data.view("int32")
+        for index in chunk_map.ravel():
+            header = af._blocks.blocks[int(index)].header
+            assert header["compression"] == b"zlib"
+            # level 0 zlib compression does not reduce the size
+            assert header["used_size"] > header["data_size"]
+
+
+def test_get_after_close(tmp_path):
+    store = ASDFStreamingStore(tmp_path / "test.asdf")
+    arr = zarr.create((6, 9), store=store, chunks=(2, 3), dtype="f8", zarr_format=2)
+    arr[:] = 1
+    store.close()
+    with pytest.raises(ValueError, match="store is closed"):
+        arr[:]
+
+
+def test_serialize_outside_store(tmp_path):
+    store = ASDFStreamingStore(tmp_path / "test.asdf")
+    arr = zarr.create((6, 9), store=store, chunks=(2, 3), dtype="f8", zarr_format=2)
+    arr[:2, :3] = 1
+    # the store is not serializable by asdf
+    with pytest.raises(asdf.exceptions.AsdfSerializationError):
+        asdf.AsdfFile({"s": store}).write_to(tmp_path / "other.asdf")
+    # the placeholder used when the store writes the tree is only
+    # serializable while the store is writing the tree
+    placeholder = _StreamingArray(store)
+    with pytest.raises(ValueError, match="can only be written by the store"):
+        asdf.AsdfFile({"s": placeholder}).write_to(tmp_path / "other.asdf")
+    assert placeholder.chunk_block_map_index is None
+    store.close()
+    with pytest.raises(asdf.exceptions.AsdfSerializationError):
+        asdf.AsdfFile({"s": store}).write_to(tmp_path / "other.asdf")
+    with asdf.open(tmp_path / "test.asdf") as af:
+        assert np.all(af["data"][:2, :3] == 1)
@@ -1,5 +1,8 @@
 from collections import UserDict
 import itertools
+import os
+import subprocess
+import sys
 
 import asdf
 import asdf_zarr
@@ -128,3 +131,92 @@ def test_to_internal(tmp_path):
     # calling it a second time shouldn't re-wrap the store
     same = asdf_zarr.storage.to_internal(internal)
     assert same.store is internal.store
+
+
+def test_extension_import_is_lazy():
+    # asdf loads all installed extensions when resolving tags so importing
+    # the extension (and converter) should not import zarr (or other heavy
+    # dependencies) until a zarr array is converted
+    code = (
+        "import sys\n"
+        "import asdf_zarr.extensions\n"
+        "asdf_zarr.extensions.get_extensions()\n"
+        "print(' '.join(m for m in ('zarr', 'fsspec', 'asdf_zarr.storage', 'asdf_zarr.util') if m in sys.modules))\n"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code], text=True)
+    assert output.strip() == ""
+
+
+def _cumulative_import_time(module, statement, runs=5):
+    # minimum (over several runs) cumulative import time in microseconds
+    # of module as reported by "python -X importtime"
+    times = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", statement], capture_output=True, text=True, check=True
+        )
+        for line in result.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == module:
+                times.append(int(fields[1]))
+                break
+    return min(times)
+
+
+@pytest.mark.skipif(not os.environ.get("ASDF_ZARR_BENCHMARK"), reason="set ASDF_ZARR_BENCHMARK to run benchmarks")
+def test_benchmark_extension_import_time():
+    statement = "import asdf_zarr.extensions"
+    extension_time = _cumulative_import_time("asdf_zarr.extensions", statement)
+    # asdf is imported by the extension (and any process loading it)
+    asdf_time = _cumulative_import_time("asdf", statement)
+    zarr_time = _cumulative_import_time("zarr", "import zarr")
+    # loading the extension should cost much less than importing zarr
+    assert extension_time - asdf_time < zarr_time / 10
+
+
+def test_lazy_import_roundtrip(tmp_path):
+    # without the test modules importing zarr first, check that
+    # the deferred imports are sufficient to write and read an array
+    fn = tmp_path / "test.asdf"
+    code = (
+        "import asdf, numpy, zarr\n"
+        "arr = zarr.create((6, 9), chunks=(2, 3), dtype='f8', zarr_format=2, store=zarr.storage.MemoryStore())\n"
+        "arr[:] = 1\n"
+        f"asdf.AsdfFile({{'arr': arr}}).write_to({str(fn)!r})\n"
+        f"with asdf.open({str(fn)!r}) as af:\n"
+        "    assert numpy.all(af['arr'][:] == 1)\n"
+    )
+    subprocess.check_call([sys.executable, "-c", code])
+
+
+@pytest.mark.parametrize("compressor", [None, {"id": "zlib", "level": 1}])
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_chunk_compression(tmp_path, compressor, compression):
+    arr = zarr.create(
+        (6, 9), store=storage.MemoryStore(), chunks=(2, 3), dtype="f8", zarr_format=2, compressor=compressor
+    )
+    arr[:] = numpy.arange(54).reshape((6, 9))
+
+    fn = tmp_path / "test.asdf"
+    af = asdf.AsdfFile({"arr": arr})
+    af.write_to(fn, all_array_compression=compression)
+
+    # chunks compressed by zarr should not be compressed again by asdf
+    expected = None if compressor else compression
+    with asdf.open(fn, _force_raw_types=True) as af:
+        assert af["arr"]["chunk_compression"] == expected
+    with asdf.open(fn) as af:
+        chunk_map = af._blocks.blocks[-1].data.view("int32")
+        for index in chunk_map[chunk_map != asdf_zarr.storage.MISSING_CHUNK]:
+            header = af._blocks.blocks[int(index)].header
+            assert asdf._compression.validate(header["compression"]) == expected
+        assert numpy.array_equal(af["arr"][:], arr[:])
+
+        # rewriting with "input" compression should retain the chunk compression
+        fn2 = tmp_path / "test2.asdf"
+        af.write_to(fn2)
+    with asdf.open(fn2, _force_raw_types=True) as af:
+        assert af["arr"]["chunk_compression"] == expected
+    with asdf.open(fn2) as af:
+        assert numpy.array_equal(af["arr"][:], arr[:])
+